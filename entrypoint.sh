@@ -16,6 +16,7 @@ echo "=================================="
 # Create necessary directories
 mkdir -p "$DOWNLOAD_PATH"
 mkdir -p "$(dirname "$DATA_FILE")"
+mkdir -p "$(dirname "$KNOWN_LINKS_DB")"
 mkdir -p "$(dirname "$LOG_FILE")"
 
 # Set permissions
@@ -9,13 +9,18 @@ import requests
 import os
 import subprocess
 import time
-import json
+import orjson
+import sqlite3
 import logging
 from datetime import datetime, timedelta
 from urllib.parse import urljoin, urlparse
 from bs4 import BeautifulSoup
+import yt_dlp
 import re
 import random
+import itertools
+import signal
+import threading
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 import urllib3
@@ -27,10 +32,28 @@ CHECK_INTERVAL = int(os.getenv('CHECK_INTERVAL', '300'))  # seconds
 RETENTION_DAYS = int(os.getenv('RETENTION_DAYS', '7'))
 DATA_FILE = os.getenv('DATA_FILE', '/var/lib/sports-downloader/sports_downloads.json')
 KNOWN_LINKS_FILE = os.getenv('KNOWN_LINKS_FILE', '/var/lib/sports-downloader/sports_known_links.json')
+KNOWN_LINKS_DB = os.getenv('KNOWN_LINKS_DB', os.path.splitext(KNOWN_LINKS_FILE)[0] + '.db')
 LOG_FILE = os.getenv('LOG_FILE', '/var/log/sports_downloader.log')
 MAX_DOWNLOAD_TIME = int(os.getenv('MAX_DOWNLOAD_TIME', '14400'))  # 4 hours default
 MAX_FILE_SIZE = int(os.getenv('MAX_FILE_SIZE', '16106127360'))  # 15GB default
 
+# Pooled keep-alive connections per host
+HTTP_POOL_SIZE = 32
+# Default (connect, read) timeout for every session request
+REQUEST_TIMEOUT = (5, 30)
+
+# Retry strategy shared by every session. 429 is left out of status_forcelist
+# on purpose: urllib3 still retries it when the server sends Retry-After and
+# waits as long as the server asks instead of a fixed exponential backoff.
+_RETRY = Retry(
+    total=3,
+    backoff_factor=1,
+    status_forcelist=(500, 502, 503, 504),
+    allowed_methods=frozenset(['GET', 'HEAD']),
+    respect_retry_after_header=True,
+    raise_on_status=False,
+)
+
 # Handle START_DATE from environment
 START_DATE_ENV = os.getenv('START_DATE', '')
 if START_DATE_ENV:
@@ -48,6 +71,59 @@ USER_AGENTS = [
     'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
     'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:121.0) Gecko/20100101 Firefox/121.0'
 ]
+_UA_CYCLE = itertools.cycle(USER_AGENTS)
+
+def _request_headers():
+    """Per-request headers with the next user agent in the rotation"""
+    return {'User-Agent': next(_UA_CYCLE)}
+
+# Host part of WEBSITE_URL, used to keep only links that stay on the site
+HOST_NEEDLE = urlparse(WEBSITE_URL).netloc
+
+# Anchors inside post containers (article/div with a post-like class, any case)
+POST_LINK_SELECTOR = ', '.join(
+    f'{tag}[class*="{keyword}" i] a[href]'
+    for tag in ('article', 'div')
+    for keyword in ('post', 'entry', 'article', 'content')
+)
+# Fallback content areas when the page has no post containers
+MAIN_CONTENT_SELECTOR = 'main#main, main#content, div#main, div#content'
+
+# Navigation and non-content link text
+SKIP_RE = re.compile('|'.join(map(re.escape, [
+    'read more', 'continue reading', 'home', 'about', 'contact',
+    'privacy', 'terms', 'subscribe', 'follow', 'share'
+])), re.I)
+
+# Link text that looks like a sports game replay
+# Customize these keywords for different sports
+KEY_RE = re.compile('|'.join(map(re.escape, [
+    'vs', 'v.', 'game', 'replay', 'nba', 'basketball', 'football', 'soccer', 'hockey',
+    'baseball', 'highlights', 'final', 'match', 'championship'
+])), re.I)
+
+# Common video hosting sites
+VIDEO_HOSTS = ['ok.ru', 'youtube.com', 'youtu.be', 'vimeo.com', 'dailymotion.com', 'streamable.com']
+HOST_SUBSTR_RE = re.compile('|'.join(map(re.escape, VIDEO_HOSTS)))
+# Full URLs pointing at any video host, as found inside script tags
+VIDEO_HOST_RE = re.compile(r'https?://[^"\']*(?:' + HOST_SUBSTR_RE.pattern + r')[^"\']*')
+
+# yt-dlp format selector per video host (anything else uses 'best')
+FORMAT_BY_HOST = {
+    # OK.ru specific formats
+    'ok.ru': 'hd/sd/low/lowest',
+    'www.ok.ru': 'hd/sd/low/lowest',
+    'm.ok.ru': 'hd/sd/low/lowest',
+    # YouTube with quality limit
+    'youtube.com': 'best[height<=1080]',
+    'www.youtube.com': 'best[height<=1080]',
+    'm.youtube.com': 'best[height<=1080]',
+    'youtu.be': 'best[height<=1080]',
+}
+
+# Characters that are not allowed in filenames, and runs of whitespace
+_INVALID_CHARS = str.maketrans('', '', '<>:"/\\|?*')
+_WS_RE = re.compile(r'\s+')
 
 # Setup logging with rotation
 from logging.handlers import RotatingFileHandler
@@ -64,6 +140,21 @@ logging.basicConfig(
     ]
 )
 
+class DownloadTimeout(Exception):
+    """Raised when a download runs past MAX_DOWNLOAD_TIME"""
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that applies a default timeout to every request"""
+    
+    def __init__(self, *args, timeout=REQUEST_TIMEOUT, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+    
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
 class SportsDownloader:
     def __init__(self):
         # Log configuration on startup
@@ -78,14 +169,18 @@ class SportsDownloader:
         
         self.session = self.create_session()
         
-        # Create data directory if it doesn't exist
+        # Create data directories if they don't exist
         os.makedirs(os.path.dirname(DATA_FILE), exist_ok=True)
+        os.makedirs(os.path.dirname(KNOWN_LINKS_DB), exist_ok=True)
         
         self.downloaded_videos = self.load_downloaded_list()
-        self.known_links = self.load_known_links()
+        self.known_links_db = self.open_known_links_db()
+        self._downloaded_dirty = False
         
         # Create download directory if it doesn't exist
         os.makedirs(DOWNLOAD_PATH, exist_ok=True)
+        self._snapshot = None
+        self._snapshot_time = 0.0
         
         # Only clean up old partial downloads (keep recent ones for resume)
         self.cleanup_old_partial_downloads()
@@ -97,20 +192,20 @@ class SportsDownloader:
         """Create a robust session with retries and SSL handling"""
         session = requests.Session()
         
-        # Set up retry strategy
-        retry_strategy = Retry(
-            total=5,
-            backoff_factor=2,
-            status_forcelist=[429, 500, 502, 503, 504],
+        # Size the pool so requests reuse keep-alive connections instead of
+        # opening (and TLS-handshaking) new ones
+        adapter = TimeoutHTTPAdapter(
+            pool_connections=HTTP_POOL_SIZE,
+            pool_maxsize=HTTP_POOL_SIZE,
+            max_retries=_RETRY,
+            pool_block=False,
         )
-        
-        adapter = HTTPAdapter(max_retries=retry_strategy)
         session.mount("http://", adapter)
         session.mount("https://", adapter)
         
-        # Set headers with random user agent
+        # Set default headers (the user agent is rotated per request)
         session.headers.update({
-            'User-Agent': random.choice(USER_AGENTS),
+            'User-Agent': USER_AGENTS[0],
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
             'Accept-Language': 'en-US,en;q=0.5',
             'Accept-Encoding': 'gzip, deflate',
@@ -124,18 +219,48 @@ class SportsDownloader:
         
         return session
     
+    def _dir_snapshot(self, max_age=1.0):
+        """Return the os.DirEntry of every file in DOWNLOAD_PATH, cached for max_age seconds"""
+        now = time.monotonic()
+        if self._snapshot is None or now - self._snapshot_time > max_age:
+            with os.scandir(DOWNLOAD_PATH) as entries:
+                self._snapshot = [entry for entry in entries if entry.is_file()]
+            self._snapshot_time = now
+        return self._snapshot
+    
+    def _invalidate_dir_snapshot(self):
+        """Drop the cached directory snapshot after files were added or removed"""
+        self._snapshot = None
+    
+    def _find_partial_files(self, filename):
+        """Return (name, size) of partial downloads belonging to filename"""
+        prefix = filename.replace('.mp4', '')
+        partial_files = []
+        for entry in self._dir_snapshot():
+            if entry.name.startswith(prefix) and entry.name.endswith(('.part', '.f4v.part', '.webm.part')):
+                try:
+                    partial_files.append((entry.name, entry.stat().st_size))
+                except OSError:
+                    pass
+        return partial_files
+    
     def get_resumable_downloads(self):
         """Find partial downloads that can be resumed"""
         resumable = []
         try:
-            for filename in os.listdir(DOWNLOAD_PATH):
+            cutoff_ts = (datetime.now() - timedelta(days=7)).timestamp()
+            
+            for entry in self._dir_snapshot():
+                filename = entry.name
                 if filename.endswith(('.part', '.f4v.part', '.webm.part')):
-                    filepath = os.path.join(DOWNLOAD_PATH, filename)
-                    file_size = os.path.getsize(filepath)
-                    file_time = datetime.fromtimestamp(os.path.getmtime(filepath))
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    file_size = st.st_size
                     
                     # Only consider files larger than 1MB and newer than 7 days
-                    if file_size > 1024 * 1024 and file_time > datetime.now() - timedelta(days=7):
+                    if file_size > 1024 * 1024 and st.st_mtime > cutoff_ts:
                         # Try to determine the original title from filename
                         original_name = filename.replace('.part', '').replace('.f4v', '').replace('.webm', '')
                         if not original_name.endswith('.mp4'):
@@ -145,7 +270,7 @@ class SportsDownloader:
                             'partial_file': filename,
                             'original_name': original_name,
                             'size_mb': file_size / (1024 * 1024),
-                            'modified': file_time
+                            'modified': datetime.fromtimestamp(st.st_mtime)
                         })
                         
             if resumable:
@@ -161,56 +286,96 @@ class SportsDownloader:
     def cleanup_old_partial_downloads(self):
         """Clean up old partial downloads (older than 24 hours) but keep recent ones for resume"""
         try:
-            cutoff_time = datetime.now() - timedelta(hours=24)
+            cutoff_ts = (datetime.now() - timedelta(hours=24)).timestamp()
             
-            for filename in os.listdir(DOWNLOAD_PATH):
+            for entry in self._dir_snapshot():
+                filename = entry.name
                 if filename.endswith(('.part', '.ytdl', '.temp')):
-                    filepath = os.path.join(DOWNLOAD_PATH, filename)
                     try:
-                        file_time = datetime.fromtimestamp(os.path.getmtime(filepath))
-                        if file_time < cutoff_time:
-                            os.remove(filepath)
+                        if entry.stat().st_mtime < cutoff_ts:
+                            os.remove(entry.path)
                             logging.info(f"Cleaned up old partial download: {filename}")
                     except OSError:
                         pass
+            self._invalidate_dir_snapshot()
         except Exception as e:
             logging.error(f"Error cleaning up old partial downloads: {e}")
     
-    def load_known_links(self):
-        """Load the list of all known links"""
-        if os.path.exists(KNOWN_LINKS_FILE):
-            try:
-                with open(KNOWN_LINKS_FILE, 'r') as f:
-                    data = json.load(f)
-                    # Clean up old entries (older than 30 days)
-                    cutoff = datetime.now() - timedelta(days=30)
-                    cleaned_data = {}
-                    for url, info in data.items():
-                        try:
-                            discovered_date = datetime.fromisoformat(info['discovered_date'])
-                            if discovered_date >= cutoff:
-                                cleaned_data[url] = info
-                        except:
-                            pass
-                    return cleaned_data
-            except:
-                return {}
-        return {}
+    def open_known_links_db(self):
+        """Open the known links database, importing the legacy JSON file once"""
+        is_new_db = not os.path.exists(KNOWN_LINKS_DB)
+        create_table = (
+            'CREATE TABLE IF NOT EXISTS links ('
+            'url TEXT PRIMARY KEY, title TEXT, discovered_date TEXT, processed INTEGER)'
+        )
+        try:
+            # Autocommit: each insert/update is its own small WAL transaction.
+            # Wait for locks held by a previous cron run that is still downloading.
+            db = sqlite3.connect(KNOWN_LINKS_DB, isolation_level=None, timeout=30)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute(create_table)
+        except sqlite3.Error as e:
+            logging.error(f"Error opening known links database {KNOWN_LINKS_DB}: {e}")
+            # Keep running with an empty in-memory table for this run
+            db = sqlite3.connect(':memory:', isolation_level=None)
+            db.execute(create_table)
+            return db
+        
+        if is_new_db and os.path.exists(KNOWN_LINKS_FILE):
+            self.import_known_links_json(db)
+        
+        # Clean up old entries (older than 30 days)
+        cutoff = datetime.now() - timedelta(days=30)
+        try:
+            db.execute('DELETE FROM links WHERE discovered_date < ?', (cutoff.isoformat(),))
+        except sqlite3.Error as e:
+            logging.error(f"Error cleaning up known links: {e}")
+        return db
     
-    def save_known_links(self):
-        """Save the list of known links"""
+    def import_known_links_json(self, db):
+        """Import known links from the JSON file used by older versions"""
         try:
-            with open(KNOWN_LINKS_FILE, 'w') as f:
-                json.dump(self.known_links, f, indent=2)
-        except Exception as e:
-            logging.error(f"Error saving known links: {e}")
+            with open(KNOWN_LINKS_FILE, 'rb') as f:
+                data = orjson.loads(f.read())
+        except (OSError, ValueError) as e:
+            logging.error(f"Error importing known links from {KNOWN_LINKS_FILE}: {e}")
+            return
+        
+        if not isinstance(data, dict):
+            logging.error(f"Error importing known links from {KNOWN_LINKS_FILE}: expected a JSON object")
+            return
+        
+        rows = []
+        for url, info in data.items():
+            try:
+                discovered_date = datetime.fromisoformat(info['discovered_date'])
+            except (KeyError, TypeError, ValueError):
+                continue
+            rows.append((url, info.get('title'), discovered_date.isoformat(), int(bool(info.get('processed')))))
+        
+        try:
+            with db:
+                db.execute('BEGIN')
+                db.executemany('INSERT OR IGNORE INTO links VALUES (?, ?, ?, ?)', rows)
+        except sqlite3.Error as e:
+            logging.error(f"Error importing known links from {KNOWN_LINKS_FILE}: {e}")
+            return
+        logging.info(f"Imported {len(rows)} known links from {KNOWN_LINKS_FILE}")
+    
+    def _write_json_atomic(self, path, data):
+        """Write JSON to a temp file and rename it over the target"""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(orjson.dumps(data))
+        os.replace(tmp_path, path)
     
     def load_downloaded_list(self):
         """Load the list of already downloaded videos"""
         if os.path.exists(DATA_FILE):
             try:
-                with open(DATA_FILE, 'r') as f:
-                    return json.load(f)
+                with open(DATA_FILE, 'rb') as f:
+                    return orjson.loads(f.read())
             except:
                 return {}
         return {}
@@ -218,90 +383,86 @@ class SportsDownloader:
     def save_downloaded_list(self):
         """Save the list of downloaded videos"""
         try:
-            with open(DATA_FILE, 'w') as f:
-                json.dump(self.downloaded_videos, f, indent=2)
+            self._write_json_atomic(DATA_FILE, self.downloaded_videos)
+            self._downloaded_dirty = False
         except Exception as e:
             logging.error(f"Error saving downloaded list: {e}")
     
+    def _flush_downloaded_list(self):
+        """Save the downloaded list only if it changed since the last save"""
+        if self._downloaded_dirty:
+            self.save_downloaded_list()
+    
     def is_new_video(self, video_url, title):
         """Check if this is a new video"""
         # Skip obviously non-video links
         if any(skip in title.lower() for skip in ['home', 'about', 'contact', 'category', 'tag']):
             return False
             
-        if video_url not in self.known_links:
-            self.known_links[video_url] = {
-                'title': title,
-                'discovered_date': datetime.now().isoformat(),
-                'processed': False
-            }
-            self.save_known_links()
-            return datetime.now() >= START_DATE
+        row = self.known_links_db.execute(
+            'SELECT discovered_date, processed FROM links WHERE url = ?', (video_url,)
+        ).fetchone()
+        
+        if row is None:
+            now = datetime.now()
+            self.known_links_db.execute(
+                'INSERT OR IGNORE INTO links VALUES (?, ?, ?, 0)',
+                (video_url, title, now.isoformat())
+            )
+            return now >= START_DATE
         
-        link_info = self.known_links[video_url]
-        discovered_date = datetime.fromisoformat(link_info['discovered_date'])
+        discovered_date, processed = row
         
-        return (discovered_date >= START_DATE and not link_info.get('processed', False))
+        return (datetime.fromisoformat(discovered_date) >= START_DATE and not processed)
     
     def mark_video_processed(self, video_url):
         """Mark a video as processed"""
-        if video_url in self.known_links:
-            self.known_links[video_url]['processed'] = True
-            self.save_known_links()
+        self.known_links_db.execute('UPDATE links SET processed = 1 WHERE url = ?', (video_url,))
     
     def get_video_links(self):
         """Scrape the main website for video links"""
         try:
-            # Add delay and rotate user agent
+            # Add delay before the request
             time.sleep(random.uniform(1, 3))
-            self.session.headers['User-Agent'] = random.choice(USER_AGENTS)
             
-            response = self.session.get(WEBSITE_URL, timeout=30)
+            response = self.session.get(WEBSITE_URL, headers=_request_headers())
             response.raise_for_status()
             
-            soup = BeautifulSoup(response.content, 'html.parser')
+            soup = BeautifulSoup(response.content, 'lxml')
             video_links = []
             
-            # Look for post containers first
-            posts = soup.find_all(['article', 'div'], class_=lambda x: x and any(
-                keyword in x.lower() for keyword in ['post', 'entry', 'article', 'content']
-            ))
+            # Look for links in post containers first
+            anchors = soup.select(POST_LINK_SELECTOR)
             
-            if not posts:
+            if not anchors:
                 # Fallback to all links in main content area
-                main_content = soup.find(['main', 'div'], {'id': ['main', 'content']}) or soup
-                posts = [main_content]
+                main_content = soup.select_one(MAIN_CONTENT_SELECTOR) or soup
+                anchors = main_content.select('a[href]')
             
-            for post in posts:
-                for link in post.find_all('a', href=True):
-                    href = link.get('href')
-                    text = link.get_text(strip=True)
-                    
-                    # Skip empty or very short links
-                    if not text or not href or len(text) < 10:
-                        continue
-                    
-                    # Skip navigation and non-content links
-                    if any(skip in text.lower() for skip in [
-                        'read more', 'continue reading', 'home', 'about', 'contact',
-                        'privacy', 'terms', 'subscribe', 'follow', 'share'
-                    ]):
-                        continue
-                    
-                    full_url = urljoin(WEBSITE_URL, href)
-                    
-                    # Only include links that look like sports game replays
-                    # Customize these keywords for different sports
-                    if (any(keyword in text.lower() for keyword in 
-                           ['vs', 'v.', 'game', 'replay', 'nba', 'basketball', 'football', 'soccer', 'hockey', 
-                            'baseball', 'highlights', 'final', 'match', 'championship']) and
-                        WEBSITE_URL.replace('https://', '').replace('http://', '') in full_url and
-                        len(text) > 15):  # Longer titles are more likely to be games
-                        
-                        video_links.append({
-                            'title': text,
-                            'url': full_url
-                        })
+            for link in anchors:
+                href = link.get('href')
+                text = link.get_text(strip=True)
+                
+                # Skip empty or short links (longer titles are more likely
+                # to be games); checked first since it is the cheapest test
+                if not text or not href or len(text) <= 15:
+                    continue
+                
+                # Skip navigation and non-content links
+                if SKIP_RE.search(text):
+                    continue
+                
+                # Only include links that look like sports game replays
+                if not KEY_RE.search(text):
+                    continue
+                
+                full_url = urljoin(WEBSITE_URL, href)
+                
+                if HOST_NEEDLE in full_url:
+                    video_links.append({
+                        'title': text,
+                        'url': full_url
+                    })
             
             # Remove duplicates
             seen = set()
@@ -324,40 +485,33 @@ class SportsDownloader:
     def find_video_source_link(self, video_page_url):
         """Find video source link (ok.ru, youtube, etc.) on a video page"""
         try:
-            # Add delay and rotate user agent
+            # Add delay before the request
             time.sleep(random.uniform(2, 4))
-            self.session.headers['User-Agent'] = random.choice(USER_AGENTS)
             
-            response = self.session.get(video_page_url, timeout=30)
+            response = self.session.get(video_page_url, headers=_request_headers())
             response.raise_for_status()
             
-            soup = BeautifulSoup(response.content, 'html.parser')
+            soup = BeautifulSoup(response.content, 'lxml')
             
             # Look for video source links in various places
             video_links = []
             
-            # Common video hosting sites
-            video_hosts = ['ok.ru', 'youtube.com', 'youtu.be', 'vimeo.com', 'dailymotion.com', 'streamable.com']
-            
             # Direct links
             for link in soup.find_all('a', href=True):
                 href = link.get('href')
-                if any(host in href for host in video_hosts):
+                if HOST_SUBSTR_RE.search(href):
                     video_links.append(href)
             
             # Embedded iframes
             for iframe in soup.find_all('iframe', src=True):
                 src = iframe.get('src')
-                if any(host in src for host in video_hosts):
+                if HOST_SUBSTR_RE.search(src):
                     video_links.append(src)
             
             # Look in script tags for embedded links
             for script in soup.find_all('script'):
                 if script.string:
-                    for host in video_hosts:
-                        pattern = r'https?://[^"\']*' + re.escape(host) + r'[^"\']*'
-                        matches = re.findall(pattern, script.string)
-                        video_links.extend(matches)
+                    video_links.extend(m.group(0) for m in VIDEO_HOST_RE.finditer(script.string))
             
             if video_links:
                 # Prefer certain sources (ok.ru for basketball, youtube for others)
@@ -381,21 +535,23 @@ class SportsDownloader:
     
     def sanitize_filename(self, filename):
         """Sanitize filename for filesystem"""
-        # Remove invalid characters
-        filename = re.sub(r'[<>:"/\\|?*]', '', filename)
-        # Replace multiple spaces with single space
-        filename = re.sub(r'\s+', ' ', filename)
-        # Remove extra whitespace and dots
-        filename = filename.strip(' .')
-        
-        # Limit length
-        if len(filename) > 200:
-            filename = filename[:200]
+        # Remove invalid characters, collapse whitespace, strip extra
+        # whitespace and dots, and limit length
+        filename = _WS_RE.sub(' ', filename.translate(_INVALID_CHARS)).strip(' .')[:200]
         
         if not filename.endswith('.mp4'):
             filename += '.mp4'
         return filename
     
+    def _progress_hook(self, status):
+        """yt-dlp progress hook that aborts downloads running past MAX_DOWNLOAD_TIME"""
+        if status.get('status') == 'downloading' and time.monotonic() > self._download_deadline:
+            raise DownloadTimeout()
+    
+    def _download_alarm(self, signum, frame):
+        """SIGALRM handler that aborts downloads stalled past MAX_DOWNLOAD_TIME"""
+        raise DownloadTimeout()
+    
     def download_video(self, video_url, title):
         """Download video using yt-dlp with resume capability"""
         try:
@@ -414,13 +570,11 @@ class SportsDownloader:
                     os.remove(filepath)
             
             # Check for existing partial downloads that can be resumed
-            partial_files = []
-            for existing in os.listdir(DOWNLOAD_PATH):
-                if (existing.startswith(filename.replace('.mp4', '')) and 
-                    existing.endswith(('.part', '.f4v.part', '.webm.part'))):
-                    partial_size = os.path.getsize(os.path.join(DOWNLOAD_PATH, existing))
-                    if partial_size > 1024 * 1024:  # Only consider sizeable partial files
-                        partial_files.append((existing, partial_size))
+            self._invalidate_dir_snapshot()
+            partial_files = [
+                (existing, partial_size) for existing, partial_size in self._find_partial_files(filename)
+                if partial_size > 1024 * 1024  # Only consider sizeable partial files
+            ]
             
             if partial_files:
                 largest_partial = max(partial_files, key=lambda x: x[1])
@@ -428,53 +582,61 @@ class SportsDownloader:
                 logging.info("yt-dlp will automatically resume from this point")
             
             # Determine format based on video source
-            format_selector = 'best'
-            if 'ok.ru' in video_url:
-                format_selector = 'hd/sd/low/lowest'  # OK.ru specific formats
-            elif 'youtube.com' in video_url or 'youtu.be' in video_url:
-                format_selector = 'best[height<=1080]'  # YouTube with quality limit
-            
-            # Download using yt-dlp
-            cmd = [
-                'yt-dlp',
-                '--no-playlist',
-                '--format', format_selector,
-                '--output', filepath,
-                '--continue',  # Continue partial downloads
-                '--no-part',   # Don't use .part files for better resume support
-                '--retries', '10',
-                '--fragment-retries', '10',
-                '--retry-sleep', '5',
-                '--socket-timeout', '30',
-                '--no-check-certificates',  # Help with SSL issues
-                '--concurrent-fragments', '1',  # Reduce for stability
-                '--hls-use-mpegts',  # Better for live/long streams
-                '--no-warnings',
-                '--progress',  # Show progress for monitoring
-                '--verbose',   # Add verbose logging to debug issues
-                video_url
-            ]
+            format_selector = FORMAT_BY_HOST.get(urlparse(video_url).hostname, 'best')
+            
+            # Download in-process with the yt-dlp API
+            ydl_opts = {
+                'noplaylist': True,
+                'format': format_selector,
+                'outtmpl': filepath,
+                'continuedl': True,  # Continue partial downloads
+                'nopart': True,      # Don't use .part files for better resume support
+                'retries': 10,
+                'fragment_retries': 10,
+                'retry_sleep_functions': {'http': lambda n: 5},
+                'socket_timeout': 30,
+                'nocheckcertificate': True,  # Help with SSL issues
+                'concurrent_fragment_downloads': 1,  # Reduce for stability
+                'hls_use_mpegts': True,  # Better for live/long streams
+                'quiet': True,
+                'no_warnings': True,
+                'logger': logging.getLogger('ytdlp'),
+                'progress_hooks': [self._progress_hook],
+            }
             
             logging.info(f"Downloading: {title}")
             logging.info(f"Source: {video_url}")
-            logging.info(f"Command: {' '.join(cmd)}")
-            
-            result = subprocess.run(
-                cmd, 
-                capture_output=True, 
-                text=True, 
-                timeout=MAX_DOWNLOAD_TIME
-            )
-            
-            if result.returncode == 0:
+            logging.info(f"Format: {format_selector}")
+            
+            self._download_deadline = time.monotonic() + MAX_DOWNLOAD_TIME
+            # The progress hook only runs while data is flowing; the alarm also
+            # covers stalled connections and slow extraction (main thread only)
+            use_alarm = threading.current_thread() is threading.main_thread()
+            if use_alarm:
+                previous_handler = signal.signal(signal.SIGALRM, self._download_alarm)
+                signal.alarm(MAX_DOWNLOAD_TIME)
+            try:
+                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                    retcode = ydl.download([video_url])
+                error = None
+            except yt_dlp.utils.DownloadError as e:
+                retcode = 1
+                error = e
+            finally:
+                if use_alarm:
+                    signal.alarm(0)
+                    signal.signal(signal.SIGALRM, previous_handler)
+                self._invalidate_dir_snapshot()
+            
+            if retcode == 0:
                 if os.path.exists(filepath):
                     file_size = os.path.getsize(filepath)
                     if file_size > 10 * 1024 * 1024:  # At least 10MB for complete videos
-                        subprocess.run(['chmod', '644', filepath])
+                        os.chmod(filepath, 0o644)
                         logging.info(f"Successfully downloaded: {filename} ({file_size / (1024*1024):.1f} MB)")
                         
                         # Clean up any remaining partial files for this video
-                        for existing in os.listdir(DOWNLOAD_PATH):
+                        for existing in (entry.name for entry in self._dir_snapshot()):
                             if (existing.startswith(filename.replace('.mp4', '')) and 
                                 existing != filename and
                                 existing.endswith(('.part', '.ytdl', '.temp'))):
@@ -483,6 +645,7 @@ class SportsDownloader:
                                     logging.info(f"Cleaned up partial file: {existing}")
                                 except:
                                     pass
+                        self._invalidate_dir_snapshot()
                         
                         return True
                     else:
@@ -493,32 +656,28 @@ class SportsDownloader:
                     return False
             else:
                 logging.error(f"Download failed for {title}")
-                logging.error(f"yt-dlp stderr: {result.stderr}")
+                if error:
+                    logging.error(f"yt-dlp error: {error}")
                 
                 # Check if we have a partial download that can be resumed later
-                for existing in os.listdir(DOWNLOAD_PATH):
-                    if (existing.startswith(filename.replace('.mp4', '')) and 
-                        existing.endswith(('.part', '.f4v.part', '.webm.part'))):
-                        partial_size = os.path.getsize(os.path.join(DOWNLOAD_PATH, existing))
-                        if partial_size > 1024 * 1024:  # At least 1MB
-                            logging.info(f"Partial download available for resume: {existing} ({partial_size / (1024*1024):.1f} MB)")
-                            break
+                for existing, partial_size in self._find_partial_files(filename):
+                    if partial_size > 1024 * 1024:  # At least 1MB
+                        logging.info(f"Partial download available for resume: {existing} ({partial_size / (1024*1024):.1f} MB)")
+                        break
                 
                 return False
                 
-        except subprocess.TimeoutExpired:
+        except DownloadTimeout:
             logging.error(f"Download timeout ({MAX_DOWNLOAD_TIME/3600:.1f}h) for {title}")
             
-            # Don't kill the process immediately - let it finish current fragment
+            # The hook only fires between chunks, so whatever was written is kept
             logging.info("Download timed out, but partial download will be available for resume")
             
             # Check what we have so far
-            for existing in os.listdir(DOWNLOAD_PATH):
-                if (existing.startswith(filename.replace('.mp4', '')) and 
-                    existing.endswith(('.part', '.f4v.part', '.webm.part'))):
-                    partial_size = os.path.getsize(os.path.join(DOWNLOAD_PATH, existing))
-                    if partial_size > 1024 * 1024:
-                        logging.info(f"Partial download saved: {existing} ({partial_size / (1024*1024):.1f} MB)")
+            self._invalidate_dir_snapshot()
+            for existing, partial_size in self._find_partial_files(filename):
+                if partial_size > 1024 * 1024:
+                    logging.info(f"Partial download saved: {existing} ({partial_size / (1024*1024):.1f} MB)")
             
             return False
         except Exception as e:
@@ -528,30 +687,34 @@ class SportsDownloader:
     def cleanup_old_files(self):
         """Remove files older than retention period"""
         try:
-            cutoff_date = datetime.now() - timedelta(days=RETENTION_DAYS)
+            cutoff_ts = (datetime.now() - timedelta(days=RETENTION_DAYS)).timestamp()
             removed_count = 0
             
-            for filename in os.listdir(DOWNLOAD_PATH):
-                filepath = os.path.join(DOWNLOAD_PATH, filename)
-                
-                if os.path.isfile(filepath) and filename.endswith('.mp4'):
-                    file_time = datetime.fromtimestamp(os.path.getctime(filepath))
+            for entry in self._dir_snapshot():
+                filename = entry.name
+                if filename.endswith('.mp4'):
+                    try:
+                        file_ctime = entry.stat().st_ctime
+                    except OSError:
+                        continue
                     
-                    if file_time < cutoff_date:
+                    if file_ctime < cutoff_ts:
                         try:
-                            os.remove(filepath)
+                            os.remove(entry.path)
                             logging.info(f"Deleted old file: {filename}")
                             removed_count += 1
                             
                             # Remove from downloaded list
                             if filename in self.downloaded_videos:
                                 del self.downloaded_videos[filename]
+                                self._downloaded_dirty = True
                         except OSError as e:
                             logging.error(f"Failed to delete {filename}: {e}")
             
             if removed_count > 0:
                 logging.info(f"Cleanup complete: removed {removed_count} old files")
-                self.save_downloaded_list()
+                self._invalidate_dir_snapshot()
+            self._flush_downloaded_list()
                         
         except Exception as e:
             logging.error(f"Error during cleanup: {e}")